@@ -1 +1,2 @@
+from . import fcm
 from . import zscore
\ No newline at end of file
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+intensity_normalization.normalize.fcm
+
+use fuzzy c-means to find a white matter mask for an image
+and normalize so that the white matter mean sits at norm_value
+
+the membership and centroid updates are vectorized numpy
+operations over the flattened brain intensities instead of
+per-voxel python loops
+"""
+
+from __future__ import print_function, division
+
+import logging
+
+import nibabel as nib
+import numpy as np
+
+try:  # cupy is optional, clustering falls back to numpy without it
+    import cupy as cp
+except ImportError:
+    cp = None
+
+logger = logging.getLogger(__name__)
+
+
+def gpu_available():
+    """
+    check whether cupy is installed and a cuda device is present
+    """
+
+    if cp is None:
+        return False
+    try:
+        return cp.cuda.runtime.getDeviceCount() > 0
+    except cp.cuda.runtime.CUDARuntimeError:
+        return False
+
+
+def fcm_normalize(img, wm_mask, norm_value=1):
+    """
+    normalize a target image by dividing by the white matter mean
+    so that the white matter mean lands on norm_value
+
+    Args:
+        img (nibabel.nifti1.Nifti1Image): target MR brain image
+        wm_mask (nibabel.nifti1.Nifti1Image): white matter mask for img
+        norm_value (float): value at which to place the WM mean
+
+    Returns:
+        normalized (nibabel.nifti1.Nifti1Image): img with WM mean at norm_value
+    """
+
+    img_data = img.get_data()
+    wm_mean = img_data[np.asarray(wm_mask.get_data(), dtype=bool)].mean()
+    normalized = nib.Nifti1Image((img_data / wm_mean) * norm_value, img.affine, img.header)
+    return normalized
+
+
+def find_wm_mask(img, brain_mask=None, threshold=0.8, gpu=False):
+    """
+    find a white matter mask for an image with three-class fuzzy c-means
+
+    Args:
+        img (nibabel.nifti1.Nifti1Image): target MR brain image
+        brain_mask (nibabel.nifti1.Nifti1Image): brain mask for img
+        threshold (float): minimum WM membership for inclusion in the mask
+        gpu (bool): run the clustering on a cuda device when one is available
+
+    Returns:
+        wm_mask (nibabel.nifti1.Nifti1Image): white matter mask for img
+    """
+
+    img_data = img.get_data()
+    if brain_mask is not None:
+        mask_data = np.asarray(brain_mask.get_data(), dtype=bool)
+    else:
+        mask_data = img_data > img_data.mean()
+    u, v = fuzzy_cmeans(img_data[mask_data], n_clusters=3, gpu=gpu)
+    wm_membership = u[:, np.argmax(v)]  # the cluster with the largest centroid is white matter
+    wm_mask_data = np.zeros(img_data.shape, dtype=np.uint8)  # the mask is {0,1}, don't carry it around as float64
+    wm_mask_data[mask_data] = wm_membership > threshold
+    wm_mask = nib.Nifti1Image(wm_mask_data, img.affine, img.header)
+    return wm_mask
+
+
+def fuzzy_cmeans(x, n_clusters=3, m=2, max_iter=50, tol=1e-5, gpu=False):
+    """
+    cluster a vector of intensities with fuzzy c-means
+
+    each iteration updates all memberships and centroids at once with
+    broadcast numpy operations over the whole intensity vector, so the
+    cost per iteration is a few array passes rather than a python loop
+    over millions of voxels; with gpu=True (and cupy plus a cuda device
+    available) the same updates run as cupy kernels on the gpu
+
+    Args:
+        x (np.ndarray): flattened vector of intensities to cluster
+        n_clusters (int): number of clusters
+        m (float): fuzziness exponent
+        max_iter (int): maximum number of update iterations
+        tol (float): stop once the centroids move less than tol
+        gpu (bool): run the updates on a cuda device when one is available
+
+    Returns:
+        u (np.ndarray): cluster memberships with shape (len(x), n_clusters)
+        v (np.ndarray): cluster centroids
+    """
+
+    xp = cp if gpu and gpu_available() else np  # cupy mirrors the numpy api, so the updates below work on either
+    x = xp.asarray(x, dtype=xp.float64).flatten()
+    v = xp.percentile(x, 100 * (xp.arange(n_clusters) + 0.5) / n_clusters)  # spread the initial centroids over the intensity range
+    p = 2 / (m - 1)
+    for _ in range(max_iter):
+        d = xp.abs(x[:, None] - v[None, :])
+        d = xp.fmax(d, xp.finfo(xp.float64).eps)  # avoid dividing by zero for voxels sitting on a centroid
+        u = 1 / ((d[:, :, None] / d[:, None, :]) ** p).sum(axis=2)
+        um = u ** m
+        v_new = (um * x[:, None]).sum(axis=0) / um.sum(axis=0)
+        shift = float(xp.max(xp.abs(v_new - v)))
+        v = v_new
+        if shift < tol:
+            break
+    if xp is not np:  # bring the results back to host memory
+        u, v = cp.asnumpy(u), cp.asnumpy(v)
+    return u, v
@@ -16,11 +16,12 @@ from __future__ import print_function, division
 import logging
 
 import nibabel as nib
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
 
-def zscore_normalize(img, mask=None):
+def zscore_normalize(img, mask=None, tol=1e-3):
     """
     normalize a target image by subtracting the mean of the whole brain
     and dividing by the standard deviation
@@ -28,6 +29,8 @@ def zscore_normalize(img, mask=None):
     Args:
         img (nibabel.nifti1.Nifti1Image): target MR brain image
         mask (nibabel.nifti1.Nifti1Image): brain mask for img
+        tol (float): if the brain mean is already within tol of 0 and the
+            standard deviation within tol of 1, skip the rescaling pass
 
     Returns:
         normalized (nibabel.nifti1.Nifti1Image): img with WM mean at norm_value
@@ -35,13 +38,15 @@ def zscore_normalize(img, mask=None):
 
     img_data = img.get_data()
     if mask is not None and not isinstance(mask, str):
-        mask_data = mask.get_data()
+        logical_mask = np.asarray(mask.get_data(), dtype=bool)  # force the mask to be logical type
     elif mask == 'nomask':
-        mask_data = img_data == img_data
+        logical_mask = np.ones(img_data.shape, dtype=bool)
     else:
-        mask_data = img_data > img_data.mean()
-    logical_mask = mask_data == 1  # force the mask to be logical type
+        logical_mask = img_data > img_data.mean()
     mean = img_data[logical_mask].mean()
     std = img_data[logical_mask].std()
+    if abs(mean) < tol and abs(std - 1) < tol:
+        logger.info('image already has zero mean and unit variance, skipping normalization')
+        return img
     normalized = nib.Nifti1Image((img_data - mean) / std, img.affine, img.header)
     return normalized
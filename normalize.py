@@ -4,36 +4,73 @@ import numpy as np
 import matplotlib.pyplot as plt
 import nibabel as nib
 import scipy as scp
+from concurrent.futures import ProcessPoolExecutor
 from intensity_normalization.normalize import zscore
 
-def main():
+def normalize_one(paths):
+    """
+    Normalize a single patient scan.
+
+    Parameters
+    --------------------
+        paths    -- tuple of (folder name, path to the nifti file)
+
+    Returns
+    --------------------
+        img data -- numpy array containing the normalized scan with the top and bottom slices removed
+    """
+    folname, fpath = paths
+    try:
+        picnift = nib.load(fpath)
+        normalized = zscore.zscore_normalize(picnift) #this is the most basic normalization
+        img_data = np.asanyarray(normalized.dataobj) # the normalized array is already in memory, don't copy it to float64 again
+        s = img_data.shape
+        img_data = img_data[:,:, util.SKIP_BOTTOM:(s[2] - util.SKIP_TOP)]
+        #img_data is type numpy ndarray
+        s = img_data.shape
+        mat1 = np.zeros((1,s[0],s[1],s[2]), dtype=np.float32)
+        mat1[0] = img_data
+        filename = folname
+        mat_dict = {}
+        mat_dict['data'] = mat1
+        #scp.io.savemat(os.path.join(util.NIFTI_DATA,filename), mat_dict)
+        return img_data
+    except Exception as e:
+        # a bad scan should not kill the rest of the batch, but its slot must be
+        # kept so later patients stay aligned with their labels by index;
+        # pipeline.py refuses to register a cohort with a failed slot
+        print("Failed to normalize {}: {}".format(fpath, e))
+        return None
+
+def main(return_data=False):
 #util.generate_nifti_images(util.ORIGINAL_DATA) if the data is already in the nifti folder, unnecessary to call again
     fols = os.listdir(util.NIFTI_DATA)
-    i = 1
-    for folname in fols:
-        for fname in os.listdir(os.path.join(util.NIFTI_DATA,folname)):
-            picnift = nib.load(os.path.join(util.NIFTI_DATA,folname, fname))
-            normalized = zscore.zscore_normalize(picnift) #this is the most basic normalization
-            img_data = normalized.get_fdata()
-            s = img_data.shape
-            img_data = img_data[:,:, util.SKIP_BOTTOM:(s[2] - util.SKIP_TOP)]    
-            #img_data is type numpy ndarray   
-            s = img_data.shape
-            mat1 = np.zeros((1,s[0],s[1],s[2]), dtype=np.float32)
-            if (i==1):
-                print(s)
-                i = i+1
-                slice_0 = img_data[int(np.floor(s[0]/2)), :, :]
-                slice_1 = img_data[:, int(np.floor(s[1]/2)), :]
-                slice_2 = img_data[:, :, int(np.floor(s[2]/2))]
-                util.show_slices([slice_0, slice_1, slice_2])
-                plt.suptitle("Center slices for 1st patient")  # doctest: +SKIP
-                plt.show()
-            mat1[0] = img_data
-            filename = folname
-            mat_dict = {}
-            mat_dict['data'] = mat1
-            #scp.io.savemat(os.path.join(util.NIFTI_DATA,filename), mat_dict)
+    # precompute the whole work list in one comprehension with the path join
+    # bound to a local, so nothing is re-resolved per scan while dispatching
+    join = os.path.join
+    args = [(folname, fpath)
+            for folname in fols
+            for fpath in util.list_nifti_files(join(util.NIFTI_DATA, folname))]
+
+    # each scan is normalized independently of the others, so we can dispatch
+    # them across all cores instead of processing one patient at a time
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor: # map preserves the order of args
+        results = [(folname, r) for (folname, _), r in zip(args, executor.map(normalize_one, args))]
+
+    processed = [r for _, r in results if r is not None]
+    if len(processed) > 0:
+        img_data = processed[0]
+        s = img_data.shape
+        print(s)
+        slice_0 = img_data[int(np.floor(s[0]/2)), :, :]
+        slice_1 = img_data[:, int(np.floor(s[1]/2)), :]
+        slice_2 = img_data[:, :, int(np.floor(s[2]/2))]
+        util.show_slices([slice_0, slice_1, slice_2])
+        plt.suptitle("Center slices for 1st patient")  # doctest: +SKIP
+        plt.show()
+
+    if return_data: # pipeline mode keeps the normalized scans in memory for the next stage
+        return results
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,38 @@
+import os
+import importlib.util
+
+import normalize
+
+# Running normalize.py and image-reg.py as separate commands pays the heavy
+# library imports (SimpleITK, matplotlib, nibabel) once per script. This entry
+# point runs both stages in a single interpreter so the imports are paid once.
+
+def load_image_reg():
+    """
+    Import image-reg.py as a module.
+
+    The file has a dash in its name so a normal import statement cannot load it.
+
+    Returns
+    --------------------
+        image reg    -- the loaded image-reg module
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "image-reg.py")
+    spec = importlib.util.spec_from_file_location("image_reg", path)
+    image_reg = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(image_reg)
+    return image_reg
+
+def main():
+    image_reg = load_image_reg()
+    results = normalize.main(return_data=True) # normalize the nifti images
+    failed = [folname for folname, img in results if img is None]
+    if len(failed) > 0: # a dropped scan would shift every later patient off its label
+        raise RuntimeError("Normalization failed for patients: {}".format(failed))
+    results.sort(key = lambda val: int(val[0])) # order by patient ID so the data aligns with labels
+    # hand the normalized scans straight to registration instead of writing .mat
+    # files for the next stage to read back
+    image_reg.main(data=[img for _, img in results])
+
+if __name__ == '__main__':
+    main()
@@ -128,7 +128,7 @@ def tile_images(data, labels):
         labels          -- the labels corresponding to each output image
     """
     n,m,y,x = np.shape(data)
-    output_images = np.zeros((n, 4*y, 3*x))
+    output_images = np.zeros((n, 4*y, 3*x), dtype=np.float32) # keep the tiles at the data's own precision, the default float64 doubles the memory
     for i in range(n):
         index = 0
         for j in range(4):
@@ -1,4 +1,5 @@
 import os
+import functools
 import pydicom
 import numpy as np
 from scipy.io import loadmat
@@ -20,6 +21,7 @@ TEMPLATE_DATA = "Data/GG-366-FLAIR-1.0mm.nii"
 LABEL_DATA = 'Data/Scores/All_Fazekas_Data.xlsx'
 SKIP_BOTTOM = 10
 SKIP_TOP = 1
+NIFTI_COMPRESSION = False # gzip on every volume is slow and these files are only read back by normalize.py
 TEMPLATE_BOTTOM = 36
 TEMPLATE_TOP = 156
 TEMPLATE_ITER = 10
@@ -38,23 +40,42 @@ def load_patient_scans(data_path, skip_bottom=SKIP_BOTTOM, skip_top=SKIP_TOP):
                         one pixel array for each of the n patient images
     """
     dcmImages = [pydicom.read_file(data_path + '/' + s) for s in os.listdir(data_path)] # read the dicom image
-    dcmImages.sort(key = lambda image: image.ImagePositionPatient[2]) # ensure the list is sorted in z-dimension (might not be needed)
+    positions = [float(image.ImagePositionPatient[2]) for image in dcmImages]
+    if any(a > b for a, b in zip(positions, positions[1:])): # most scans arrive already ordered, so check before paying for the sort
+        dcmImages.sort(key = lambda image: image.ImagePositionPatient[2]) # ensure the list is sorted in z-dimension
     dcmImages = dcmImages[skip_bottom:len(dcmImages)-skip_top]
     dcm_scans = [image.pixel_array for image in dcmImages] # get the pixel array from each dicom image
     dcm_scans = np.asarray(dcm_scans, dtype=np.float32)
     return dcm_scans
 
-def generate_nifti_images(data_path, skip_bottom=SKIP_BOTTOM, skip_top=SKIP_TOP):
+def generate_nifti_images(data_path, skip_bottom=SKIP_BOTTOM, skip_top=SKIP_TOP, compression=NIFTI_COMPRESSION):
     dirname = data_path
     fols = os.listdir(dirname)
     for folname in fols:
         path = os.path.join(NIFTI_DATA,folname)
         if (os.path.isdir(path) == False):
             os.mkdir(path)
-        dicom2nifti.convert_directory(os.path.join(dirname,folname), path, compression=True, reorient=True)
+        dicom2nifti.convert_directory(os.path.join(dirname,folname), path, compression=compression, reorient=True)
         files = os.listdir(os.path.join(dirname,folname))
         ds_list.append([pydicom.read_file(os.path.join(dirname, folname,file))] for file in files)
 
+def list_nifti_files(data_path):
+    """
+    List the nifti files in a folder.
+
+    Parameters
+    --------------------
+        data path    -- string formatted path to the folder containing nifti files
+
+    Returns
+    --------------------
+        file paths   -- sorted list of paths to the .nii/.nii.gz files in the folder
+    """
+    # scandir returns the file type from a single directory read, so no per-entry
+    # stat calls are paid the way they would be with glob or listdir + isfile
+    return sorted(e.path for e in os.scandir(data_path)
+                  if e.is_file() and (e.name.endswith('.nii') or e.name.endswith('.nii.gz')))
+
 def show_slices(slices):
    # Function to display row of nifti image slices 
     fig, axes = plt.subplots(1, len(slices))
@@ -109,6 +130,7 @@ def load_processed_data(data_path):
     data = loadmat(data_path)['data'] # load the data from the mat file
     return data
 
+@functools.lru_cache(maxsize=4) # repeated loads of the same template become dict lookups instead of nifti decodes
 def load_template_data(path, template_bottom=TEMPLATE_BOTTOM, template_top=TEMPLATE_TOP, template_iter=TEMPLATE_ITER):
     """
     Load template data to be used as the fixed image in image registration.
@@ -125,12 +147,15 @@ def load_template_data(path, template_bottom=TEMPLATE_BOTTOM, template_top=TEMPL
         data        -- numpy array containing the template data
     """
     img = nib.load(path)
-    data = img.get_data()
     _, ext = os.path.splitext(path)
     if ext == ".nii": # this is the template version we will be using
+        # slice through the lazy array proxy so only the scans we keep are read off disk,
+        # instead of materializing the full volume and then throwing most of it away
+        data = np.asarray(img.dataobj[..., template_bottom:template_top:template_iter])
         data = data.T # it needs to be formatted correctly
-        data = data[template_bottom:TEMPLATE_TOP:TEMPLATE_ITER] # select the slices we want to use
         data = np.fliplr(data)
+    else:
+        data = img.get_data()
     return data
 
 def multi_slice_subplot(data): # plot all MRI slices on a subplot